@@ -1,79 +1,161 @@
 #!/usr/bin/env python3
 
 import math
+import numpy as np
 import streamlit as st
-import matplotlib.pyplot as plt
-from matplotlib.ticker import LinearLocator, MultipleLocator
 
 R = 8.314  # Gas constant (J/mol·K)
 STD_PRESSURE = 760.0  # Atomospheric pressure (Torr)
 
-# Plot style
-plt.rcParams.update(
-    {
-        "font.family": "sans-serif",
-        "xtick.direction": "in",
-        "ytick.direction": "in",
-        "xtick.major.width": 1.0,
-        "ytick.major.width": 1.0,
-        "font.size": 8,
-        "axes.linewidth": 1.0,
-    }
-)
+
+# モル蒸発エンタルピーの計算方法とその番号. T-H-E則以外はΔH = Tb * _DH_COEFFS[番号]
+_CAL_METHODS = {"Trouton's rule": 0, "Methane": 1, "Water": 2, "T-H-E rule": 3}
+_THE_RULE = _CAL_METHODS["T-H-E rule"]
+_DH_COEFFS = (85.0, 73.0, 109.0)
+
+
+def _dh(method_id, Tb):  # モル蒸発エンタルピー. Tbは大気圧下での沸点
+    return (4.4 + math.log(Tb)) * R * Tb if method_id == _THE_RULE else Tb * _DH_COEFFS[method_id]
+
+
+# Clausius-Clapeyron式によりln(p/STD_PRESSURE)における沸点を計算. 引数は配列でも可で, ブロードキャストされる
+def _bp_from_logratio(Tb, dH, log_ratio):
+    return 1.0 / ((1.0 / Tb) - (log_ratio * R / dH))
+
+
+# T-H-E則で既知の沸点known_T (K), 圧力known_p (Torr)からTbを求める
+# f(Tb) = 1/Tb - ln(p/760)/((4.4 + ln(Tb))Tb) - 1/known_T = 0 をTrouton's ruleの解を初期値にNewton法で解く
+def _solve_the(known_T, known_p):
+    log_ratio = math.log(known_p / STD_PRESSURE)
+    Tb = known_T * (1 - R / 85 * log_ratio)
+    for _ in range(4):
+        g = (4.4 + math.log(Tb)) * Tb  # ΔH/R
+        f = 1 / Tb - log_ratio / g - 1 / known_T
+        fp = -1 / Tb**2 + log_ratio * (5.4 + math.log(Tb)) / g**2
+        Tb -= f / fp
+    return Tb
 
 
 class Molecule:
+    __slots__ = ("name", "known_bp", "is_set_from_known_bp", "Tb", "_cal_method", "_method_id", "_delta_H")
+    cal_methods = _CAL_METHODS  # 全インスタンスで共有
+
     def __init__(self, name, Tb=273.0, cal_method="Trouton's rule"):
         self.name = name  # Name of the molecule
         self.known_bp = [Tb, STD_PRESSURE]  # 既知の圧力下での沸点 [K, Torr]
         self.is_set_from_known_bp = False
         self.Tb = Tb  # 大気圧下での沸点 (K)
-
-        self.delta_Hs = {  # モル蒸発エンタルピーの関数。xは大気圧下での沸点Tb
-            "Trouton's rule": lambda x: x * 85,
-            "Methane": lambda x: x * 73,
-            "Water": lambda x: x * 109,
-            "T-H-E rule": lambda x: (4.4 + math.log(x)) * R * x,
-        }
         self.cal_method = cal_method  # モル蒸発エンタルピーの計算方法
 
+    @property
+    def cal_method(self):
+        return self._cal_method
+
+    @cal_method.setter
+    def cal_method(self, cal_method):
+        self._cal_method = cal_method
+        self._method_id = self.cal_methods[cal_method]
+        self._invalidate()
+
+    def _invalidate(self):  # TbまたはΔHの計算方法が変わった場合にΔHを再計算して保持
+        self._delta_H = _dh(self._method_id, self.Tb)
+
     def set_from_Tb(self, Tb):  # Tbが既知の場合のTbの設定
         self.Tb = Tb
         self.known_bp = [Tb, STD_PRESSURE]
+        self._invalidate()
 
     def set_from_known_bp(self, known_T, known_p):  # Tbが未知の場合のTbの設定
         self.is_set_from_known_bp = True
-        if self.cal_method == "T-H-E rule":  # T-H-E則の場合は解析的に解けないのでTrouton's ruleを使用
-            cal_method = "Trouton's rule"
+        if self._method_id == _THE_RULE:  # T-H-E則の場合は解析的に解けないのでNewton法で解く
+            self.Tb = _solve_the(known_T, known_p)
         else:
-            cal_method = self.cal_method
-        self.Tb = known_T * (1 - R / self.delta_Hs[cal_method](1) * math.log(known_p / STD_PRESSURE))
+            self.Tb = known_T * (1 - R / _DH_COEFFS[self._method_id] * math.log(known_p / STD_PRESSURE))
         self.known_bp = [known_T, known_p]
+        self._invalidate()
 
     def recalc_Tb(self):  # ΔHの計算手法に変更がありかつTbが未知の場合にTbを再計算
         if self.is_set_from_known_bp:
             self.set_from_known_bp(self.known_bp[0], self.known_bp[1])
 
-    def boiling_point_at(self, p):  # Clausius-Clapeyron式により圧力pにおける沸点を計算
-        delta_H = self.delta_Hs[self.cal_method](self.Tb)
+    def boiling_point_at(self, p):  # Clausius-Clapeyron式により圧力pにおける沸点を計算. pは配列でも可
+        p = np.asarray(p)
+
+        return self.boiling_point_from_logratio(np.log(p / STD_PRESSURE))
+
+    def boiling_point_from_logratio(self, log_ratio):  # ln(p/STD_PRESSURE)が計算済みの場合の沸点
+        return _bp_from_logratio(self.Tb, self._delta_H, log_ratio)
 
-        return 1 / ((1 / self.Tb) - (math.log(p / STD_PRESSURE) * R / delta_H))
+
+# 圧力の格子とln(p/STD_PRESSURE). 全分子で共通なので一度だけ計算する
+@st.cache_data
+def pressure_grid(lo: float, hi: float) -> tuple[np.ndarray, np.ndarray]:
+    n = int(round((hi - lo) / 0.01))  # 浮動小数の刻み幅による点数のずれを避けるため整数の点数から作成
+    pressures = lo + 0.01 * np.arange(n, dtype=np.float32)  # 表示用なので単精度で十分
+    return pressures, np.log(pressures / STD_PRESSURE)
+
+
+# 複数分子の沸点曲線を (分子数, 圧力点数) の配列としてまとめて計算
+# dHsは各分子のMolecule._delta_H. 引数はハッシュしやすい値にしてキャッシュする
+@st.cache_data
+def compute_curves(Tbs: tuple[float, ...], dHs: tuple[float, ...], lo: float, hi: float) -> np.ndarray:
+    _, log_ratio = pressure_grid(lo, hi)
+    Tbs = np.array(Tbs, dtype=np.float32)
+    dHs = np.array(dHs, dtype=np.float32)
+    return _bp_from_logratio(Tbs[:, None], dHs[:, None], log_ratio[None, :]) - 273  # (℃)
+
+
+# 入力が前回の再実行から変わっていなければsession_stateに保持した曲線を返す
+def get_curves(mols: list[Molecule], pressure_range) -> np.ndarray:
+    inputs = (tuple(mol.Tb for mol in mols), tuple(mol._delta_H for mol in mols), pressure_range)
+    cached = st.session_state.get("cache_curves", (None,))
+    if cached[:3] == inputs:
+        return cached[3]
+
+    bps = compute_curves(inputs[0], inputs[1], *pressure_range)
+    st.session_state.cache_curves = (*inputs, bps)
+    return bps
+
+
+# グラフの生成. Figureはセッションごとに一度だけ作成し, 再実行時は線のデータのみ更新する
+def get_fig():
+    if "fig" not in st.session_state:
+        import plotly.graph_objects as go  # 起動を遅くしないよう最初の描画時に読み込む
+
+        fig = go.Figure()
+        for key in ("mol1", "mol2", "mol3"):  # 色の順序を固定するため先に作成
+            fig.add_scatter(x=[], y=[], mode="lines", name=key)
+        fig.update_layout(
+            title="Pressure vs Boiling Points",
+            showlegend=True,  # 線が1本だけでも凡例を表示
+            legend={"x": 1, "y": 0, "xanchor": "right", "yanchor": "bottom"},
+        )
+        fig.update_xaxes(title="Pressure (Torr)", tickformat=".1f", nticks=10, ticks="inside", minor_showgrid=True)
+        fig.update_yaxes(title="Temperature (℃)", tickformat=".1f", nticks=10, ticks="inside", minor_showgrid=True)
+        st.session_state.fig = fig
+
+    return st.session_state.fig
 
 
 # Sidebar for molecule settings
+# 沸点の値と計算方法は入力ごとに再実行されないようformにまとめ, Updateボタンで一度に反映する
+# 名前と表示を切り替えるチェックボックスはformの外に置き, 元の順序 (名前が先頭) を保つ
 def molecule_sidebar(mol: Molecule, idx: int):
     mol.name = st.sidebar.text_input("Name", value=mol.name, key=f"name_{idx}")
 
     use_other_pressure = st.sidebar.checkbox("Use other pressure", key=f"useP_{idx}")
+
+    form = st.sidebar.form(f"settings_{idx}")
     if use_other_pressure:
-        P = st.sidebar.number_input("Pressure (Torr)", value=760.0, key=f"P_{idx}")
-        T = st.sidebar.number_input("Temperature (℃)", value=mol.Tb - 273, key=f"T_{idx}") + 273
+        P = form.number_input("Pressure (Torr)", value=760.0, key=f"P_{idx}")
+        T = form.number_input("Temperature (℃)", value=mol.Tb - 273, key=f"T_{idx}") + 273
         mol.set_from_known_bp(T, P)
     else:
-        Tb_input = st.sidebar.number_input("b.p. at 760 Torr (℃)", value=mol.Tb - 273, key=f"Tb_{idx}") + 273
+        Tb_input = form.number_input("b.p. at 760 Torr (℃)", value=mol.Tb - 273, key=f"Tb_{idx}") + 273
         mol.set_from_Tb(Tb_input)
 
-    mol.cal_method = st.sidebar.selectbox("Use ΔH of ...", list(mol.delta_Hs), key=f"method_{idx}")
+    mol.cal_method = form.selectbox("Use ΔH of ...", list(mol.cal_methods), key=f"method_{idx}")
+    form.form_submit_button("Update")
 
     mol.recalc_Tb()
 
@@ -100,8 +182,7 @@ def main():
     # main window
     st.title("Boiling Points Estimator")
     pressure_range = st.slider("Pressure range (Torr)", 0.01, 10.0, (0.1, 7.0))
-    pressures = [p * 0.01 for p in range(int(pressure_range[0] * 100), int(pressure_range[1] * 100))]
-    bp1 = [st.session_state.mol1.boiling_point_at(p) - 273 for p in pressures]
+    pressures, _ = pressure_grid(*pressure_range)
 
     # Print Tb
     st.divider()
@@ -114,27 +195,21 @@ def main():
 
     # graph
     st.divider()
-    fig, ax = plt.subplots()
-    ax.set_title("Pressure vs Boiling Points")
-    ax.plot(pressures, bp1, label=st.session_state.mol1.name)
-    if add_second:
-        bp2 = [st.session_state.mol2.boiling_point_at(p) - 273 for p in pressures]
-        ax.plot(pressures, bp2, label=st.session_state.mol2.name)
-    if add_third:
-        bp3 = [st.session_state.mol3.boiling_point_at(p) - 273 for p in pressures]
-        ax.plot(pressures, bp3, label=st.session_state.mol3.name)
-    ax.set_xlim(pressure_range)
-    ax.set_xlabel("Pressure (Torr)")
-    ax.set_ylabel("Temperature (℃)")
-    ax.xaxis.set_major_locator(LinearLocator(10))
-    ax.xaxis.set_minor_locator(LinearLocator(50))
-    ax.yaxis.set_major_locator(LinearLocator(10))
-    ax.yaxis.set_minor_locator(LinearLocator(50))
-    plt.gca().xaxis.set_major_formatter(plt.FormatStrFormatter("%.1f"))  # x軸小数点以下1桁表示
-    plt.gca().yaxis.set_major_formatter(plt.FormatStrFormatter("%.1f"))  # y軸小数点以下1桁表示
-    ax.legend(loc="lower right")
-    ax.grid(which="minor")
-    st.pyplot(fig)
+    fig = get_fig()
+    curves = {  # 線のキー: (分子, 表示するか)
+        "mol1": (st.session_state.mol1, True),
+        "mol2": (st.session_state.mol2, add_second),
+        "mol3": (st.session_state.mol3, add_third),
+    }
+    active = [key for key, (_, is_shown) in curves.items() if is_shown]
+    bps = get_curves([curves[key][0] for key in active], pressure_range)
+    traces = dict(zip(curves, fig.data))
+    for key, trace in traces.items():
+        trace.visible = key in active
+    for key, bp in zip(active, bps):
+        traces[key].update(x=pressures, y=bp, name=curves[key][0].name)
+    fig.update_xaxes(range=pressure_range)
+    st.plotly_chart(fig, width="stretch")
 
 
 if __name__ == "__main__":